@@ -5,7 +5,7 @@ from dotenv import load_dotenv
 from typing import Annotated, Dict, Any, List, Literal, TypedDict, Optional, Union
 from langchain_community.document_loaders import WebBaseLoader
 from langchain_core.tools import Tool, tool
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, ToolMessage
 from langchain_nvidia_ai_endpoints import ChatNVIDIA
 from langgraph.graph import StateGraph, MessagesState, START, END
 from langgraph.prebuilt import create_react_agent
@@ -13,7 +13,8 @@ from langgraph.types import Command
 from typing_extensions import TypedDict
 from langchain_tavily import TavilySearch
 import json
-from langchain_openai import ChatOpenAI
+from llm_client import AdaptiveChatOpenAI, LLM_DEADLINE_SECONDS, get_llm_metrics
+from profile_index import ProfileIndex, build_spending_profile, minhash_signature, profile_token_digests
 
 
 # Load environment variables
@@ -30,12 +31,12 @@ _set_if_undefined("OPENAI_API_KEY")
 
 # Initialize the LLM
 # model = ChatNVIDIA(model="meta/llama-3.3-70b-instruct", temperature=0)
-model = ChatOpenAI(
+model = AdaptiveChatOpenAI(
     model="gpt-4.1-2025-04-14",
     temperature=0,
     max_tokens=None,
-    timeout=None,
-    max_retries=2,
+    timeout=LLM_DEADLINE_SECONDS,
+    max_retries=0,
 )
 
 # Tools definition
@@ -53,6 +54,9 @@ def search_for_money_saving_alternatives(query: str) -> str:
         Relevant information from the web about money-saving alternatives.
     """
     search_results = web_search.invoke(query)
+    # TavilySearch returns a response dict with the hits under "results"
+    if isinstance(search_results, dict):
+        search_results = search_results.get("results", [])
     
     # Format the results for better readability
     formatted_results = "## Web Search Results\n\n"
@@ -276,6 +280,68 @@ recommender_agent = create_react_agent(
     """
 )
 
+# Research reuse helpers
+# The similarity index itself lives in profile_index.py; these steps decide what
+# may be cached and adapt cached research to the current user.
+def research_used_search(messages):
+    """
+    Check whether a Researcher run got at least one usable web search result.
+    
+    Args:
+        messages: Messages returned by the researcher agent
+        
+    Returns:
+        bool: True if a search tool call succeeded and returned results
+    """
+    return any(
+        isinstance(message, ToolMessage)
+        and getattr(message, "status", "success") != "error"
+        and "### Result" in str(message.content)
+        for message in messages
+    )
+
+def generalize_research(research_results):
+    """
+    Rewrite research so it no longer depends on the user it was made for.
+    
+    Args:
+        research_results: Researcher output for one user
+        
+    Returns:
+        str: Research without the user's purchases, amounts or payees
+    """
+    response = model.invoke(f"""
+    Rewrite the following money-saving research as general advice about the merchants, brands and categories it covers.
+    Remove everything that describes the user it was written for: their purchases, amounts spent, dates, frequencies and the names of people they paid.
+    Keep the alternatives, promotions, prices of alternatives and money-saving strategies. Return only the rewritten research.
+    
+    Research: {research_results}
+    """)
+    return response.content.strip()
+
+def adapt_research(research_results, transactions):
+    """
+    Adapt cached, user-independent research to the current user's transactions.
+    
+    Args:
+        research_results: Cached research from a similar spending profile
+        transactions: The current user's transactions
+        
+    Returns:
+        str: Research tailored to the current user
+    """
+    response = model.invoke(f"""
+    You are given general money-saving research and a user's transactions.
+    Adapt the research to these transactions: keep only the alternatives and strategies relevant to the merchants and categories the user actually spends on, and refer to their own spending where useful.
+    Do not add merchants, purchases or amounts that are not in the transactions. Return only the adapted research.
+    
+    Research: {research_results}
+    Transactions: {json.dumps(transactions)}
+    """)
+    return response.content.strip()
+
+profile_index = ProfileIndex()
+
 # Define agent nodes
 def classifier_node(state: AgentState) -> Command:
     # Extract transaction data from the user's message if not already done
@@ -369,14 +435,44 @@ def researcher_node(state: AgentState) -> Command:
         ]
     }
     
+    # Reuse research from a similar spending profile instead of searching again
+    transactions = state.get("transaction_data") or []
+    merchant_analysis = analyze_transactions_by_merchant(transactions)
+    profile = build_spending_profile(merchant_analysis, state.get("classification_results"))
+    signature = minhash_signature(profile, profile_index.key)
+    tokens = profile_token_digests(profile, profile_index.key)
+    
+    if signature is not None:
+        cached_entry, similarity = profile_index.query(signature, tokens)
+        if cached_entry is not None:
+            print(f"Reusing research from a similar spending profile (similarity {similarity:.2f})")
+            research_results = adapt_research(cached_entry["research_results"], transactions)
+            if research_results:
+                return Command(
+                    update={
+                        "messages": state.get("messages", []) + [
+                            HumanMessage(content=research_results, name="Researcher")
+                        ],
+                        "research_results": research_results
+                    },
+                    goto="supervisor",
+                )
+    
     result = researcher_agent.invoke(state_with_input)
+    research_results = result["messages"][-1].content
+    
+    # Only cache runs that actually found something, stripped of this user's details
+    if signature is not None and research_results.strip() and research_used_search(result["messages"]):
+        general_research = generalize_research(research_results)
+        if general_research:
+            profile_index.add(signature, tokens, general_research)
     
     return Command(
         update={
             "messages": state.get("messages", []) + [
-                HumanMessage(content=result["messages"][-1].content, name="Researcher")
+                HumanMessage(content=research_results, name="Researcher")
             ],
-            "research_results": result["messages"][-1].content
+            "research_results": research_results
         },
         goto="supervisor",
     )
@@ -675,6 +771,10 @@ def analyze_multiple_bunq_transactions(json_file_pattern):
             
             print(f"\nResults saved to {output_file}")
             
+            print(f"\nLLM METRICS:")
+            for key, value in get_llm_metrics().items():
+                print(f"  {key}: {value}")
+            
             return final_state.get("final_recommendation") 
         else:
             print("No valid final state was returned from the graph.")
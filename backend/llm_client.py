@@ -0,0 +1,365 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from email.utils import parsedate_to_datetime
+from typing import Literal, Union
+
+import openai
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from pydantic import Field
+
+
+# Load environment variables before reading the client configuration
+load_dotenv()
+
+# Adaptive LLM client
+# Every call site shares one process-wide rate limiter, so concurrent callers
+# queue up instead of each retrying on its own and turning a 429 into a storm.
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "30000"))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "120"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "0"))  # 0 disables hedging
+LLM_HEDGE_MAX_WORKERS = int(os.getenv("LLM_HEDGE_MAX_WORKERS", "32"))
+
+for _name, _value in (
+    ("LLM_REQUESTS_PER_MINUTE", LLM_REQUESTS_PER_MINUTE),
+    ("LLM_TOKENS_PER_MINUTE", LLM_TOKENS_PER_MINUTE),
+    ("LLM_DEADLINE_SECONDS", LLM_DEADLINE_SECONDS),
+    ("LLM_MAX_ATTEMPTS", LLM_MAX_ATTEMPTS),
+    ("LLM_HEDGE_MAX_WORKERS", LLM_HEDGE_MAX_WORKERS),
+):
+    if _value <= 0:
+        raise ValueError(f"{_name} must be greater than 0, got {_value}")
+for _name, _value in (
+    ("LLM_BACKOFF_BASE_SECONDS", LLM_BACKOFF_BASE_SECONDS),
+    ("LLM_BACKOFF_MAX_SECONDS", LLM_BACKOFF_MAX_SECONDS),
+    ("LLM_HEDGE_AFTER_SECONDS", LLM_HEDGE_AFTER_SECONDS),
+):
+    if _value < 0:
+        raise ValueError(f"{_name} must not be negative, got {_value}")
+
+class LLMRateLimiter:
+    """
+    Process-wide token bucket limiting both requests and tokens per minute.
+    
+    A 429 with a retry-after hint pauses the whole bucket, so every caller
+    backs off together rather than only the one that got rejected.
+    """
+    
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        if requests_per_minute <= 0 or tokens_per_minute <= 0:
+            raise ValueError("Requests and tokens per minute must be greater than 0")
+        self.request_capacity = requests_per_minute
+        self.token_capacity = tokens_per_minute
+        self.requests_available = requests_per_minute
+        self.tokens_available = tokens_per_minute
+        self.paused_until = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests_available = min(
+            self.request_capacity, self.requests_available + elapsed * self.request_capacity / 60
+        )
+        self.tokens_available = min(
+            self.token_capacity, self.tokens_available + elapsed * self.token_capacity / 60
+        )
+    
+    def acquire(self, tokens, deadline):
+        """
+        Block until a request carrying `tokens` may be sent.
+        
+        Args:
+            tokens: Estimated number of tokens the request will use
+            deadline: time.monotonic() value after which to give up
+        
+        Returns:
+            float: Seconds spent waiting
+        """
+        started = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                needed_tokens = min(tokens, self.token_capacity)
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                elif self.requests_available >= 1 and self.tokens_available >= needed_tokens:
+                    self.requests_available -= 1
+                    self.tokens_available -= tokens
+                    return now - started
+                else:
+                    delay = max(
+                        (1 - self.requests_available) * 60 / self.request_capacity,
+                        (needed_tokens - self.tokens_available) * 60 / self.token_capacity,
+                    )
+            
+            if now + delay > deadline:
+                raise TimeoutError("LLM call deadline exceeded while waiting for rate limit")
+            time.sleep(delay)
+    
+    def adjust(self, tokens):
+        """Correct the token bucket once the real usage of a request is known."""
+        with self.lock:
+            self.tokens_available -= tokens
+    
+    def pause(self, seconds):
+        """Stop handing out capacity to every caller for `seconds`."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class LLMMetrics:
+    """Thread-safe concurrency, latency and error counters for LLM calls."""
+    
+    def __init__(self, max_samples=1000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=max_samples)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.counters = {
+            "calls": 0,
+            "attempts": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "deadline_exceeded": 0,
+            "hedges_launched": 0,
+            "hedges_won": 0,
+            "hedges_skipped": 0,
+        }
+        self.throttled_seconds = 0.0
+    
+    def increment(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+    
+    def add_throttled(self, seconds):
+        with self.lock:
+            self.throttled_seconds += seconds
+    
+    def attempt_started(self):
+        with self.lock:
+            self.counters["attempts"] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    
+    def attempt_finished(self, latency, succeeded):
+        with self.lock:
+            self.in_flight -= 1
+            if succeeded:
+                self.latencies.append(latency)
+    
+    def snapshot(self):
+        """
+        Return a copy of the current metrics.
+        
+        Returns:
+            dict: Counters, concurrency and latency percentiles in seconds
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            snapshot = dict(self.counters)
+            snapshot["in_flight"] = self.in_flight
+            snapshot["max_in_flight"] = self.max_in_flight
+            snapshot["throttled_seconds"] = round(self.throttled_seconds, 3)
+        
+        for name, percentile in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            if latencies:
+                index = min(len(latencies) - 1, int(percentile * len(latencies)))
+                snapshot[f"latency_{name}"] = round(latencies[index], 3)
+            else:
+                snapshot[f"latency_{name}"] = None
+        return snapshot
+
+llm_rate_limiter = LLMRateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+llm_metrics = LLMMetrics()
+
+# Hedged attempts run on this pool. A blocking HTTP call cannot be interrupted,
+# so the losing attempt of a hedge keeps its worker (and counts as in flight)
+# until the server answers or its timeout, at most the remaining deadline,
+# fires. The slots cap how many such attempts can pile up; once they are all
+# taken, calls run unhedged on the caller's thread instead of queueing.
+_hedge_executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_MAX_WORKERS, thread_name_prefix="llm-hedge")
+_hedge_slots = threading.BoundedSemaphore(LLM_HEDGE_MAX_WORKERS)
+
+def _submit_hedged(fn, *args, **kwargs):
+    """Run fn on the hedge pool, or return None if every worker is busy."""
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    # Carry the caller's context so callbacks and tracing see hedged attempts
+    context = contextvars.copy_context()
+    future = _hedge_executor.submit(context.run, fn, *args, **kwargs)
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+def get_llm_metrics():
+    """Return concurrency and latency metrics for all LLM calls in this process."""
+    return llm_metrics.snapshot()
+
+def _retry_after_seconds(error):
+    """Read a retry-after hint (seconds) from an OpenAI error response, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+    return None
+
+def _is_retryable(error):
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+def _estimate_tokens(messages):
+    # Rough 4-characters-per-token estimate; corrected from real usage afterwards
+    return sum(len(str(message.content)) for message in messages) // 4 + 1
+
+class AdaptiveChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI with shared rate limiting, per-call deadlines, jittered
+    retries that honour retry-after hints, and optional hedged requests.
+    
+    Retries are handled here, so construct it with max_retries=0. Streaming
+    is disabled so .stream() and streamed graph runs also go through
+    _generate; with streaming=True the stream happens inside one attempt.
+    """
+    
+    deadline_seconds: float = Field(default=LLM_DEADLINE_SECONDS, gt=0)
+    max_attempts: int = Field(default=LLM_MAX_ATTEMPTS, ge=1)
+    backoff_base_seconds: float = Field(default=LLM_BACKOFF_BASE_SECONDS, ge=0)
+    backoff_max_seconds: float = Field(default=LLM_BACKOFF_MAX_SECONDS, ge=0)
+    hedge_after_seconds: float = Field(default=LLM_HEDGE_AFTER_SECONDS, ge=0)
+    disable_streaming: Union[bool, Literal["tool_calling"]] = True
+    
+    def _attempt(self, messages, stop, run_manager, deadline, **kwargs):
+        tokens = _estimate_tokens(messages)
+        llm_metrics.add_throttled(llm_rate_limiter.acquire(tokens, deadline))
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("LLM call deadline exceeded")
+        
+        llm_metrics.attempt_started()
+        started = time.monotonic()
+        succeeded = False
+        try:
+            result = ChatOpenAI._generate(
+                self, messages, stop=stop, run_manager=run_manager, timeout=remaining, **kwargs
+            )
+            succeeded = True
+        finally:
+            llm_metrics.attempt_finished(time.monotonic() - started, succeeded)
+        
+        usage = (result.llm_output or {}).get("token_usage") or {}
+        if usage.get("total_tokens"):
+            llm_rate_limiter.adjust(usage["total_tokens"] - tokens)
+        return result
+    
+    def _hedged_attempt(self, messages, stop, run_manager, deadline, **kwargs):
+        remaining = deadline - time.monotonic()
+        if not self.hedge_after_seconds or self.hedge_after_seconds >= remaining:
+            return self._attempt(messages, stop, run_manager, deadline, **kwargs)
+        
+        primary = _submit_hedged(self._attempt, messages, stop, run_manager, deadline, **kwargs)
+        if primary is None:
+            llm_metrics.increment("hedges_skipped")
+            return self._attempt(messages, stop, run_manager, deadline, **kwargs)
+        
+        done, _ = wait([primary], timeout=self.hedge_after_seconds)
+        if done:
+            return primary.result()
+        
+        # The primary is slow: race a second request and take whichever succeeds first
+        hedge = _submit_hedged(self._attempt, messages, stop, None, deadline, **kwargs)
+        if hedge is None:
+            llm_metrics.increment("hedges_skipped")
+            return primary.result()
+        
+        llm_metrics.increment("hedges_launched")
+        pending = {primary, hedge}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        llm_metrics.increment("hedges_won")
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+                last_error = future.exception()
+        raise last_error
+    
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        deadline = time.monotonic() + self.deadline_seconds
+        llm_metrics.increment("calls")
+        
+        for attempt in range(self.max_attempts):
+            try:
+                result = self._hedged_attempt(messages, stop, run_manager, deadline, **kwargs)
+                llm_metrics.increment("successes")
+                return result
+            except TimeoutError:
+                llm_metrics.increment("deadline_exceeded")
+                llm_metrics.increment("failures")
+                raise
+            except Exception as e:
+                if isinstance(e, openai.RateLimitError):
+                    llm_metrics.increment("rate_limited")
+                if not _is_retryable(e) or attempt == self.max_attempts - 1:
+                    llm_metrics.increment("failures")
+                    raise
+                
+                backoff = random.uniform(
+                    0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt)
+                )
+                retry_after = _retry_after_seconds(e)
+                if retry_after is not None:
+                    backoff = retry_after + random.uniform(0, self.backoff_base_seconds)
+                    if isinstance(e, openai.RateLimitError):
+                        llm_rate_limiter.pause(retry_after)
+                
+                if time.monotonic() + backoff > deadline:
+                    llm_metrics.increment("deadline_exceeded")
+                    llm_metrics.increment("failures")
+                    raise
+                
+                print(f"LLM call failed ({type(e).__name__}), retrying in {backoff:.1f}s")
+                llm_metrics.increment("retries")
+                time.sleep(backoff)
+    
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Route async calls through the same limiter, deadlines and retries,
+        # keeping callbacks and tracing context on the worker thread
+        sync_run_manager = run_manager.get_sync() if run_manager else None
+        return await asyncio.to_thread(self._generate, messages, stop, sync_run_manager, **kwargs)
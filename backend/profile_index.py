@@ -0,0 +1,357 @@
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+
+# Load environment variables before reading the index configuration
+load_dotenv()
+
+# Spending-profile similarity index
+# Users with near-identical spending profiles (same merchants, same categories)
+# get the same research back from the Researcher, so we keep a local MinHash/LSH
+# index of profiles and reuse cached research for close matches. Only a
+# user-independent rewrite of the research is cached, and it is adapted to the
+# current user's transactions before reuse.
+PROFILE_INDEX_FILE = os.getenv("PROFILE_INDEX_FILE", "profile_index.json")
+PROFILE_INDEX_KEY_FILE = os.getenv("PROFILE_INDEX_KEY_FILE", "profile_index.key")
+PROFILE_SIMILARITY_THRESHOLD = float(os.getenv("PROFILE_SIMILARITY_THRESHOLD", "0.8"))
+PROFILE_INDEX_MAX_ENTRIES = int(os.getenv("PROFILE_INDEX_MAX_ENTRIES", "500"))
+PROFILE_INDEX_TTL_DAYS = float(os.getenv("PROFILE_INDEX_TTL_DAYS", "30"))
+
+MINHASH_PERMUTATIONS = 128
+LSH_MIN_RECALL = 0.99  # Chance that a profile exactly at the threshold becomes a candidate
+MAX_TOKEN_WEIGHT = 10
+_MERSENNE_PRIME = (1 << 61) - 1
+
+_rng = random.Random(2025)
+_MINHASH_PARAMS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+def load_profile_index_key(key_file=PROFILE_INDEX_KEY_FILE):
+    """
+    Load the secret used to hash profile tokens.
+    
+    Taken from PROFILE_INDEX_KEY if set, otherwise from key_file, which is
+    created with a random key on first use. If the key file cannot be read or
+    written, a key for this process only is used, so the cache still works
+    within the run but entries from other runs will not match.
+    
+    Args:
+        key_file: Path of the local key file
+    
+    Returns:
+        bytes: 32-byte key for keyed blake2b hashing
+    """
+    secret = os.getenv("PROFILE_INDEX_KEY")
+    if secret:
+        return hashlib.blake2b(secret.encode("utf-8"), digest_size=32).digest()
+    
+    try:
+        with open(key_file, 'rb') as file:
+            key = file.read()
+        if len(key) == 32:
+            return key
+        print(f"Error: Profile index key {key_file} is malformed, using a temporary key.")
+        return os.urandom(32)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Error reading profile index key {key_file}: {e}")
+        return os.urandom(32)
+    
+    key = os.urandom(32)
+    try:
+        descriptor = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(key)
+    except OSError as e:
+        print(f"Error writing profile index key {key_file}: {e}")
+    return key
+
+def build_spending_profile(merchant_analysis, classification_results):
+    """
+    Build a weighted token profile of a user's spending.
+    
+    Args:
+        merchant_analysis: Output of analyze_transactions_by_merchant
+        classification_results: Output of the Classifier agent
+    
+    Returns:
+        dict: Token -> weight, covering merchants, categories and brands
+    """
+    profile = {}
+    
+    def add(token, weight=1):
+        profile[token] = profile.get(token, 0) + weight
+    
+    for merchant, analysis in (merchant_analysis or {}).items():
+        if not merchant:
+            continue
+        add(f"merchant:{merchant.strip().lower()}", analysis.get("transaction_count", 1))
+        for transaction in analysis.get("transactions", []):
+            category = transaction.get("category")
+            if category:
+                add(f"category:{category.strip().lower()}")
+    
+    classified = (classification_results or {}).get("transactions", [])
+    for item in classified:
+        if not isinstance(item, dict):
+            continue
+        if item.get("brand"):
+            add(f"brand:{str(item['brand']).strip().lower()}")
+        if item.get("product_category"):
+            add(f"category:{str(item['product_category']).strip().lower()}")
+        if item.get("is_subscription"):
+            add(f"subscription:{str(item.get('brand', '')).strip().lower()}")
+    
+    return profile
+
+def _token_hash(token, key):
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8, key=key).digest()
+    return int.from_bytes(digest, "big")
+
+def profile_token_digests(profile, key):
+    """
+    Hash the tokens of a profile with a secret key, so coverage can be checked
+    without storing merchant or payee names in a form that can be guessed.
+    
+    Args:
+        profile: Token -> weight dictionary from build_spending_profile
+        key: Secret from load_profile_index_key
+    
+    Returns:
+        list: Sorted hex digests, one per token
+    """
+    return sorted(f"{_token_hash(token, key):016x}" for token in profile)
+
+def minhash_signature(profile, key):
+    """
+    Compute a MinHash signature for a weighted profile.
+    
+    Weights are expanded into repeated tokens (capped at MAX_TOKEN_WEIGHT) so
+    the signature approximates weighted Jaccard similarity.
+    
+    Args:
+        profile: Token -> weight dictionary from build_spending_profile
+        key: Secret from load_profile_index_key
+    
+    Returns:
+        list: MINHASH_PERMUTATIONS integers, or None for an empty profile
+    """
+    hashes = []
+    for token, weight in profile.items():
+        for i in range(min(int(weight), MAX_TOKEN_WEIGHT)):
+            hashes.append(_token_hash(f"{token}#{i}", key))
+    
+    if not hashes:
+        return None
+    
+    return [
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+        for a, b in _MINHASH_PARAMS
+    ]
+
+def estimate_similarity(signature_a, signature_b):
+    """Estimate the Jaccard similarity of two MinHash signatures."""
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return matches / len(signature_a)
+
+def lsh_rows_for_threshold(threshold):
+    """
+    Pick the rows per LSH band for a similarity threshold.
+    
+    Uses the most selective banding for which a profile exactly at the
+    threshold still becomes a candidate with probability LSH_MIN_RECALL, so
+    lowering PROFILE_SIMILARITY_THRESHOLD widens the candidate search too.
+    
+    Args:
+        threshold: Minimum similarity at which research is reused
+    
+    Returns:
+        int: Rows per band (a divisor of MINHASH_PERMUTATIONS)
+    """
+    best_rows = 1
+    for rows in (1, 2, 4, 8, 16, 32, 64, 128):
+        bands = MINHASH_PERMUTATIONS // rows
+        if 1 - (1 - max(threshold, 0) ** rows) ** bands >= LSH_MIN_RECALL:
+            best_rows = rows
+    return best_rows
+
+def _is_valid_entry(entry):
+    return (
+        isinstance(entry, dict)
+        and isinstance(entry.get("signature"), list)
+        and len(entry["signature"]) == MINHASH_PERMUTATIONS
+        and all(isinstance(value, int) for value in entry["signature"])
+        and isinstance(entry.get("tokens"), list)
+        and isinstance(entry.get("research_results"), str)
+        and isinstance(entry.get("created"), (int, float))
+        and "profile" not in entry  # Older format that stored plaintext profiles
+    )
+
+class ProfileIndex:
+    """
+    Local LSH index over spending-profile signatures with cached research.
+    
+    Only signatures, keyed token hashes and user-independent research are
+    persisted. Entries expire ttl_days after they were created and are evicted
+    least-recently-used first once max_entries is exceeded. Reading and writing
+    the index file is best-effort: on failure the run carries on uncached.
+    Entries added by this process are never served back to it, so a run that
+    goes through the graph twice keeps its own fresh research.
+    """
+    
+    def __init__(self, path=PROFILE_INDEX_FILE, threshold=PROFILE_SIMILARITY_THRESHOLD,
+                 max_entries=PROFILE_INDEX_MAX_ENTRIES, ttl_days=PROFILE_INDEX_TTL_DAYS,
+                 key=None):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.rows = lsh_rows_for_threshold(threshold)
+        self.key = key if key is not None else load_profile_index_key()
+        self.entries = {}
+        self.buckets = {}
+        self.added_ids = set()
+        self.load()
+    
+    def _band_keys(self, signature):
+        return [
+            f"{start}:" + ",".join(str(v) for v in signature[start:start + self.rows])
+            for start in range(0, MINHASH_PERMUTATIONS, self.rows)
+        ]
+    
+    def _rebuild_buckets(self):
+        self.buckets = {}
+        for entry_id, entry in self.entries.items():
+            for key in self._band_keys(entry["signature"]):
+                self.buckets.setdefault(key, set()).add(entry_id)
+    
+    def _is_expired(self, entry, now):
+        return now - entry.get("created", 0) > self.ttl_seconds
+    
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            entries = data.get("entries", {}) if isinstance(data, dict) else None
+            if not isinstance(entries, dict):
+                print(f"Error: Profile index {self.path} has an unexpected format, starting empty.")
+                entries = {}
+        except FileNotFoundError:
+            entries = {}
+        except json.JSONDecodeError:
+            print(f"Error: Profile index {self.path} is not valid JSON, starting empty.")
+            entries = {}
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Error reading profile index {self.path}: {e}")
+            entries = {}
+        
+        self.entries = {
+            entry_id: entry for entry_id, entry in entries.items()
+            if _is_valid_entry(entry)
+        }
+        self._evict()
+        self._rebuild_buckets()
+    
+    def save(self):
+        # Write to a temporary file first so a crash never leaves a truncated index
+        temp_path = None
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, suffix=".tmp") as file:
+                temp_path = file.name
+                json.dump({"entries": self.entries}, file)
+            os.replace(temp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing profile index {self.path}: {e}")
+            if temp_path and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+    
+    def _evict(self):
+        now = time.time()
+        expired = [
+            entry_id for entry_id, entry in self.entries.items()
+            if self._is_expired(entry, now)
+        ]
+        for entry_id in expired:
+            del self.entries[entry_id]
+        
+        overflow = len(self.entries) - self.max_entries
+        if overflow > 0:
+            oldest = sorted(self.entries, key=lambda e: self.entries[e].get("last_used", 0))
+            for entry_id in oldest[:overflow]:
+                del self.entries[entry_id]
+    
+    def query(self, signature, tokens):
+        """
+        Find the most similar cached profile that covers every profile token.
+        
+        Args:
+            signature: MinHash signature of the profile to look up
+            tokens: Keyed token hashes from profile_token_digests
+        
+        Returns:
+            tuple: (entry, similarity), or (None, best similarity) if no cached
+            entry is close enough and covers all the tokens
+        """
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates |= self.buckets.get(key, set())
+        
+        now = time.time()
+        required_tokens = set(tokens)
+        best_entry, best_similarity = None, 0.0
+        for entry_id in candidates - self.added_ids:
+            entry = self.entries.get(entry_id)
+            if entry is None or self._is_expired(entry, now):
+                continue
+            if not required_tokens.issubset(entry["tokens"]):
+                continue
+            similarity = estimate_similarity(signature, entry["signature"])
+            if similarity > best_similarity:
+                best_entry, best_similarity = entry, similarity
+        
+        if best_entry is None or best_similarity < self.threshold:
+            return None, best_similarity
+        
+        best_entry["last_used"] = now
+        best_entry["hits"] = best_entry.get("hits", 0) + 1
+        self.save()
+        return best_entry, best_similarity
+    
+    def add(self, signature, tokens, research_results):
+        """
+        Cache user-independent research for a profile and persist the index.
+        
+        Args:
+            signature: MinHash signature of the profile
+            tokens: Keyed token hashes from profile_token_digests
+            research_results: Research text with no user-specific details
+        """
+        entry_id = hashlib.blake2b(
+            json.dumps(signature).encode("utf-8"), digest_size=16
+        ).hexdigest()
+        now = time.time()
+        self.entries[entry_id] = {
+            "signature": signature,
+            "tokens": list(tokens),
+            "research_results": research_results,
+            "created": now,
+            "last_used": now,
+            "hits": 0,
+        }
+        self.added_ids.add(entry_id)
+        self._evict()
+        self._rebuild_buckets()
+        self.save()
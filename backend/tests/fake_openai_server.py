@@ -0,0 +1,117 @@
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIServer:
+    """
+    Minimal OpenAI-compatible chat completions server that injects latency
+    and errors.
+
+    Every request takes the next scripted response from enqueue(), or the
+    default latency/status/retry-after when the script is empty.
+    """
+
+    def __init__(self, latency=0.0, status=200, retry_after=None, content="ok", port=0):
+        self.default = {"latency": latency, "status": status, "retry_after": retry_after, "content": content}
+        self.port = port
+        self.script = deque()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.httpd = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def enqueue(self, status=200, latency=0.0, retry_after=None, content=None):
+        """Script the response for the next unscripted request."""
+        self.script.append({
+            "latency": latency,
+            "status": status,
+            "retry_after": retry_after,
+            "content": content or self.default["content"],
+        })
+
+    def _next_response(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return self.script.popleft() if self.script else dict(self.default)
+
+    def _finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                response = server._next_response()
+                try:
+                    time.sleep(response["latency"])
+                    if response["status"] == 200:
+                        payload = {
+                            "id": "chatcmpl-fake",
+                            "object": "chat.completion",
+                            "created": int(time.time()),
+                            "model": body.get("model", "fake"),
+                            "choices": [{
+                                "index": 0,
+                                "message": {"role": "assistant", "content": response["content"]},
+                                "finish_reason": "stop",
+                            }],
+                            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                        }
+                    else:
+                        payload = {"error": {"message": "Injected error", "type": "fake_error", "code": None}}
+
+                    data = json.dumps(payload).encode("utf-8")
+                    self.send_response(response["status"])
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    if response["retry_after"] is not None:
+                        self.send_header("retry-after", str(response["retry_after"]))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (timeout or lost hedge)
+                    pass
+                finally:
+                    server._finished()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI server with injected latency and errors")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--status", type=int, default=200, help="HTTP status to answer with")
+    parser.add_argument("--retry-after", type=float, default=None, help="retry-after header in seconds")
+    args = parser.parse_args()
+
+    fake = FakeOpenAIServer(latency=args.latency, status=args.status, retry_after=args.retry_after, port=args.port).start()
+    print(f"Fake OpenAI server running, set OPENAI_BASE_URL={fake.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,194 @@
+import asyncio
+import contextvars
+import os
+import subprocess
+import sys
+import time
+
+import openai
+import pytest
+
+import llm_client
+from llm_client import AdaptiveChatOpenAI, LLMMetrics, LLMRateLimiter, _retry_after_seconds
+from fake_openai_server import FakeOpenAIServer
+
+
+@pytest.fixture
+def server():
+    fake = FakeOpenAIServer().start()
+    yield fake
+    fake.stop()
+
+@pytest.fixture(autouse=True)
+def fresh_limiter_and_metrics(monkeypatch):
+    monkeypatch.setattr(llm_client, "llm_rate_limiter", LLMRateLimiter(6000, 10 ** 7))
+    monkeypatch.setattr(llm_client, "llm_metrics", LLMMetrics())
+
+def make_model(server, **kwargs):
+    options = {"deadline_seconds": 5, "max_attempts": 4, "backoff_base_seconds": 0.01}
+    options.update(kwargs)
+    return AdaptiveChatOpenAI(
+        model="gpt-4.1-2025-04-14",
+        api_key="test",
+        base_url=server.url,
+        max_retries=0,
+        **options,
+    )
+
+def test_successful_call_records_metrics(server):
+    result = make_model(server).invoke("hi")
+
+    metrics = llm_client.get_llm_metrics()
+    assert result.content == "ok"
+    assert metrics["calls"] == 1
+    assert metrics["successes"] == 1
+    assert metrics["in_flight"] == 0
+    assert metrics["latency_p50"] is not None
+
+def test_rate_limit_honours_retry_after(server):
+    server.enqueue(status=429, retry_after=0.3)
+
+    started = time.monotonic()
+    result = make_model(server).invoke("hi")
+
+    metrics = llm_client.get_llm_metrics()
+    assert result.content == "ok"
+    assert time.monotonic() - started >= 0.3
+    assert server.requests == 2
+    assert metrics["rate_limited"] == 1
+    assert metrics["retries"] == 1
+
+def test_server_errors_are_retried(server):
+    server.enqueue(status=500)
+    server.enqueue(status=503)
+
+    result = make_model(server).invoke("hi")
+
+    assert result.content == "ok"
+    assert server.requests == 3
+    assert llm_client.get_llm_metrics()["retries"] == 2
+
+def test_client_errors_are_not_retried(server):
+    server.enqueue(status=400)
+
+    with pytest.raises(openai.BadRequestError):
+        make_model(server).invoke("hi")
+
+    assert server.requests == 1
+    assert llm_client.get_llm_metrics()["failures"] == 1
+
+def test_gives_up_after_max_attempts(server):
+    for _ in range(2):
+        server.enqueue(status=500)
+
+    with pytest.raises(openai.InternalServerError):
+        make_model(server, max_attempts=2).invoke("hi")
+
+    assert server.requests == 2
+
+def test_deadline_bounds_slow_requests(server):
+    server.enqueue(latency=2)
+    server.enqueue(latency=2)
+
+    started = time.monotonic()
+    with pytest.raises((openai.APITimeoutError, TimeoutError)):
+        make_model(server, deadline_seconds=0.5).invoke("hi")
+
+    assert time.monotonic() - started < 1.5
+    assert llm_client.get_llm_metrics()["deadline_exceeded"] == 1
+
+def test_hedged_request_wins_over_slow_primary(server):
+    server.enqueue(latency=1.5)
+
+    started = time.monotonic()
+    result = make_model(server, hedge_after_seconds=0.1).invoke("hi")
+
+    metrics = llm_client.get_llm_metrics()
+    assert result.content == "ok"
+    assert time.monotonic() - started < 1.0
+    assert metrics["hedges_launched"] == 1
+    assert metrics["hedges_won"] == 1
+
+def test_fast_primary_is_not_hedged(server):
+    result = make_model(server, hedge_after_seconds=1).invoke("hi")
+
+    assert result.content == "ok"
+    assert server.requests == 1
+    assert llm_client.get_llm_metrics()["hedges_launched"] == 0
+
+def test_stream_goes_through_the_adaptive_client(server):
+    chunks = list(make_model(server).stream("hi"))
+
+    assert "".join(chunk.content for chunk in chunks) == "ok"
+    assert llm_client.get_llm_metrics()["calls"] == 1
+
+def test_async_calls_go_through_the_adaptive_client(server):
+    result = asyncio.run(make_model(server).ainvoke("hi"))
+
+    assert result.content == "ok"
+    assert llm_client.get_llm_metrics()["calls"] == 1
+
+def test_max_attempts_must_be_positive(server):
+    with pytest.raises(ValueError):
+        make_model(server, max_attempts=0)
+
+def test_hedged_attempts_keep_the_caller_context():
+    request_id = contextvars.ContextVar("request_id")
+    request_id.set("caller")
+
+    future = llm_client._submit_hedged(request_id.get)
+
+    assert future.result() == "caller"
+
+@pytest.mark.parametrize("name", ["LLM_REQUESTS_PER_MINUTE", "LLM_TOKENS_PER_MINUTE", "LLM_HEDGE_MAX_WORKERS"])
+def test_invalid_settings_fail_on_import(name):
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", "import llm_client"],
+        cwd=backend,
+        env=dict(os.environ, **{name: "0"}),
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode != 0
+    assert f"{name} must be greater than 0" in result.stderr
+
+def test_limiter_rejects_zero_budget():
+    with pytest.raises(ValueError):
+        LLMRateLimiter(requests_per_minute=0, tokens_per_minute=1000)
+
+def test_limiter_spaces_requests_over_budget():
+    limiter = LLMRateLimiter(requests_per_minute=120, tokens_per_minute=10 ** 6)
+    for _ in range(120):
+        limiter.acquire(1, time.monotonic() + 1)
+
+    waited = limiter.acquire(1, time.monotonic() + 5)
+
+    assert waited >= 0.4
+
+def test_limiter_pause_applies_to_every_caller():
+    limiter = LLMRateLimiter(requests_per_minute=6000, tokens_per_minute=10 ** 6)
+    limiter.pause(0.3)
+
+    assert limiter.acquire(1, time.monotonic() + 5) >= 0.25
+
+def test_limiter_raises_when_deadline_passes():
+    limiter = LLMRateLimiter(requests_per_minute=6000, tokens_per_minute=1000)
+    limiter.acquire(1000, time.monotonic() + 1)
+
+    with pytest.raises(TimeoutError):
+        limiter.acquire(1000, time.monotonic() + 0.1)
+
+def test_retry_after_parsing():
+    class Response:
+        def __init__(self, headers):
+            self.headers = headers
+
+    class Error:
+        def __init__(self, headers):
+            self.response = Response(headers)
+
+    assert _retry_after_seconds(Error({"retry-after-ms": "250"})) == 0.25
+    assert _retry_after_seconds(Error({"retry-after": "2"})) == 2.0
+    assert _retry_after_seconds(Error({})) is None
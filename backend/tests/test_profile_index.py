@@ -0,0 +1,189 @@
+import os
+import time
+
+import pytest
+
+from profile_index import (
+    MINHASH_PERMUTATIONS,
+    ProfileIndex,
+    build_spending_profile,
+    estimate_similarity,
+    load_profile_index_key,
+    lsh_rows_for_threshold,
+    minhash_signature,
+    profile_token_digests,
+)
+
+
+KEY = b"k" * 32
+
+def merchant_analysis(merchants):
+    return {
+        merchant: {"transaction_count": count, "transactions": [{"category": category}] * count}
+        for merchant, (count, category) in merchants.items()
+    }
+
+def profile_for(merchants, key=KEY):
+    profile = build_spending_profile(merchant_analysis(merchants), None)
+    return minhash_signature(profile, key), profile_token_digests(profile, key)
+
+BASE = {"McDonald's": (5, "Food and Drink"), "Albert Heijn": (3, "Groceries")}
+
+def make_index(tmp_path, **kwargs):
+    options = {"path": str(tmp_path / "index.json"), "key": KEY}
+    options.update(kwargs)
+    return ProfileIndex(**options)
+
+def add_from_other_run(tmp_path, merchants, research="general research", **kwargs):
+    # Entries are only served to later processes, so write through a separate index
+    signature, tokens = profile_for(merchants)
+    make_index(tmp_path, **kwargs).add(signature, tokens, research)
+    return signature, tokens
+
+def test_profile_covers_merchants_categories_and_brands():
+    profile = build_spending_profile(
+        merchant_analysis(BASE),
+        {"transactions": [{"brand": "McDonald's", "product_category": "Fast food", "is_subscription": False}]},
+    )
+
+    assert profile["merchant:mcdonald's"] == 5
+    assert profile["category:groceries"] == 3
+    assert profile["brand:mcdonald's"] == 1
+    assert profile["category:fast food"] == 1
+
+def test_empty_profile_has_no_signature():
+    assert minhash_signature({}, KEY) is None
+
+def test_near_identical_profile_is_a_hit(tmp_path):
+    add_from_other_run(tmp_path, BASE)
+    similar = dict(BASE, **{"McDonald's": (4, "Food and Drink")})
+
+    entry, similarity = make_index(tmp_path).query(*profile_for(similar))
+
+    assert entry["research_results"] == "general research"
+    assert similarity >= 0.8
+
+def test_profile_with_extra_merchant_is_a_miss(tmp_path):
+    signature, _ = add_from_other_run(tmp_path, BASE)
+    extended = dict(BASE, Netflix=(1, "Subscriptions"))
+    extended_signature, extended_tokens = profile_for(extended)
+
+    entry, _ = make_index(tmp_path).query(extended_signature, extended_tokens)
+
+    assert estimate_similarity(signature, extended_signature) >= 0.8
+    assert entry is None
+
+def test_dissimilar_profile_is_a_miss(tmp_path):
+    add_from_other_run(tmp_path, BASE)
+
+    entry, _ = make_index(tmp_path).query(*profile_for({"NS": (1, "Travel")}))
+
+    assert entry is None
+
+def test_entries_added_in_this_process_are_not_reused(tmp_path):
+    index = make_index(tmp_path)
+    signature, tokens = profile_for(BASE)
+    index.add(signature, tokens, "general research")
+
+    entry, _ = index.query(signature, tokens)
+
+    assert entry is None
+
+def test_entry_past_ttl_is_dropped(tmp_path):
+    signature, tokens = add_from_other_run(tmp_path, BASE)
+    index = make_index(tmp_path)
+    for entry in index.entries.values():
+        entry["created"] -= 31 * 24 * 60 * 60
+
+    assert index.query(signature, tokens)[0] is None
+
+    index.save()
+    assert make_index(tmp_path).entries == {}
+
+def test_hits_do_not_extend_ttl(tmp_path):
+    signature, tokens = add_from_other_run(tmp_path, BASE)
+    index = make_index(tmp_path)
+    entry, _ = index.query(signature, tokens)
+
+    assert entry["last_used"] >= entry["created"]
+    assert not index._is_expired(entry, entry["created"] + index.ttl_seconds)
+    assert index._is_expired(entry, entry["created"] + index.ttl_seconds + 1)
+
+def test_least_recently_used_entry_is_evicted_over_cap(tmp_path):
+    index = make_index(tmp_path, max_entries=2)
+    profiles = [profile_for({name: (1, "General")}) for name in ("A", "B", "C")]
+    for signature, tokens in profiles[:2]:
+        index.add(signature, tokens, "research")
+    oldest_id, newest_id = list(index.entries)
+    index.entries[oldest_id]["last_used"] = time.time() - 100
+
+    index.add(*profiles[2], "research")
+
+    assert len(index.entries) == 2
+    assert oldest_id not in index.entries
+    assert newest_id in index.entries
+
+def test_index_survives_save_and_reload(tmp_path):
+    signature, tokens = add_from_other_run(tmp_path, BASE, research="cached")
+
+    reloaded = make_index(tmp_path)
+    entry, similarity = reloaded.query(signature, tokens)
+
+    assert len(reloaded.entries) == 1
+    assert entry["research_results"] == "cached"
+    assert similarity == 1.0
+
+def test_index_file_contains_no_plaintext_names(tmp_path):
+    add_from_other_run(tmp_path, BASE)
+
+    content = (tmp_path / "index.json").read_text()
+
+    assert "McDonald" not in content
+    assert "Albert Heijn" not in content
+
+def test_token_hashes_depend_on_key():
+    profile = build_spending_profile(merchant_analysis(BASE), None)
+
+    assert profile_token_digests(profile, KEY) != profile_token_digests(profile, b"x" * 32)
+
+@pytest.mark.parametrize("content", ["[]", '{"entries": []}', "not json", '{"entries": {"a": {"signature": [1]}}}'])
+def test_malformed_index_file_starts_empty(tmp_path, content):
+    (tmp_path / "index.json").write_text(content)
+
+    assert make_index(tmp_path).entries == {}
+
+def test_unwritable_index_path_does_not_raise(tmp_path, capsys):
+    index = make_index(tmp_path, path=str(tmp_path / "missing" / "index.json"))
+
+    index.add(*profile_for(BASE), "research")
+
+    assert len(index.entries) == 1
+    assert "Error writing profile index" in capsys.readouterr().out
+
+def test_failed_save_removes_temp_file(tmp_path):
+    index = make_index(tmp_path)
+    index.entries["bad"] = {"signature": object()}
+
+    index.save()
+
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+def test_key_file_is_created_and_reused(tmp_path, monkeypatch):
+    monkeypatch.delenv("PROFILE_INDEX_KEY", raising=False)
+    key_file = str(tmp_path / "index.key")
+
+    key = load_profile_index_key(key_file)
+
+    assert len(key) == 32
+    assert load_profile_index_key(key_file) == key
+
+def test_key_from_environment_overrides_key_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_INDEX_KEY", "secret")
+
+    assert load_profile_index_key(str(tmp_path / "index.key")) == load_profile_index_key(str(tmp_path / "other.key"))
+    assert not (tmp_path / "index.key").exists()
+
+@pytest.mark.parametrize("threshold, rows", [(0.0, 1), (0.3, 2), (0.8, 4), (0.95, 16)])
+def test_lsh_rows_follow_threshold(threshold, rows):
+    assert lsh_rows_for_threshold(threshold) == rows
+    assert MINHASH_PERMUTATIONS % rows == 0